@@ -1,32 +1,63 @@
 #!/usr/bin/env python3
-from .util import PersistentDict, cfgpath, indent, wrap
+from . import util
+from .util import PersistentDict, SourceCache, DummyContextManager, \
+    indent, wrap
 from .event import Event, EventSource
 from .mail import mail_self
+from .record import PayloadCache
 from datetime import datetime
 import traceback
 now = datetime.now()
+import argparse
 import os
+import pwd
 
 
-def main():
+def main(cfgpath=util.cfgpath, user=None, replay=None):
+    """
+    queries all event sources from cfgpath/cfg, and mails a digest of all
+    new events to user (default: $USER).
+
+    when replaying a recorded run, replay is the datetime of that run.
+    the digest is then printed instead; events that were marked as sent
+    at or after that time count as new, and nothing is written to the
+    database.
+    """
     # import all event yielders that the cfg may use
     from .hbci import query_bank
     from .dkb import query_dkb_visa
     from .feed import query_feed
 
-    sentevents = PersistentDict(table='events')
+    util.use_profile(cfgpath, readonly=replay is not None)
+
+    sentevents = PersistentDict(cfgpath + '/sqlite', table='events')
     newevents = []
 
+    def issent(uid):
+        sent = sentevents.get(uid)
+        if sent is None:
+            return False
+        if replay is None:
+            return True
+        return datetime.fromisoformat(sent) < replay
+
+    # secrets and cfg see the module's globals, as well as the yielders;
+    # each profile gets a fresh copy
+    namespace = dict(globals(),
+                     query_bank=query_bank,
+                     query_dkb_visa=query_dkb_visa,
+                     query_feed=query_feed)
+
     # read passwords
-    exec(open(cfgpath + '/secrets').read())
+    exec(open(cfgpath + '/secrets').read(), namespace)
 
     for call in open(cfgpath + '/cfg').read().split('\n'):
         if not call.strip() or call.strip().startswith('#'):
             continue
 
         try:
-            for e in eval(call):
-                if isinstance(e, Event) and e.uid and e.uid in sentevents:
+            for e in eval(call, namespace):
+                if isinstance(e, Event) and e.uid and issent(e.uid):
                     continue
 
                 newevents.append(e)
@@ -48,20 +79,94 @@ def main():
 
     body = '\n'.join(body)
 
+    if replay is not None:
+        print(body)
+        return
+
     filename = cfgpath + "/digests/" + now.strftime('%Y-%m-%d-%H-%M-%S-%f')
 
     open(filename, 'w').write(body)
 
-    mail_self(subject, body)
+    mail_self(subject, body, user)
 
     for e in newevents:
         if isinstance(e, Event) and e.uid:
             sentevents[e.uid] = str(now)
 
 
+def profile_owner(cfgpath):
+    """
+    returns the name of the user who owns the profile directory
+    """
+    return pwd.getpwuid(os.stat(cfgpath).st_uid).pw_name
+
+
+def main_profiles(cfgpaths, replay=None):
+    """
+    runs main() for each of the given profile directories.
+
+    identical source calls in several profiles (e.g. the same feed URL)
+    are fetched only once; each profile's digest is mailed to the owner
+    of its directory. failures are mailed to the owner as well, or to
+    $USER if the owner can't be determined; the remaining profiles are
+    still processed.
+    """
+    with SourceCache():
+        for cfgpath in cfgpaths:
+            user = None
+            try:
+                user = profile_owner(cfgpath)
+                main(cfgpath, user, replay)
+            except:
+                if replay is not None:
+                    traceback.print_exc()
+                    continue
+                mail_self("notifier failed", traceback.format_exc(), user)
+
+
+def cli():
+    parser = argparse.ArgumentParser(prog='eventdigest')
+    parser.add_argument('profiles', nargs='*',
+                        help="profile directories (default: ~/.eventdigest)")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--record', action='store_true',
+                      help="store all raw source payloads to the "
+                           "payloads directory of the (first) profile")
+    mode.add_argument('--replay', action='store_true',
+                      help="query sources from a recorded run instead of "
+                           "the network, and print the digests")
+    parser.add_argument('--run', help="the recorded run to replay "
+                                      "(default: the latest run)")
+    args = parser.parse_args()
+
+    if args.run is not None and not args.replay:
+        parser.error("--run requires --replay")
+
+    runformat = '%Y-%m-%d-%H-%M-%S-%f'
+    # next to the digests of the (first) profile
+    payloadpath = (args.profiles or [util.cfgpath])[0] + '/payloads'
+    if args.record:
+        payloads = PayloadCache(payloadpath, 'record', now.strftime(runformat))
+    elif args.replay:
+        payloads = PayloadCache(payloadpath, 'replay', args.run)
+    else:
+        payloads = DummyContextManager()
+
+    with payloads:
+        replay = None
+        if args.replay:
+            replay = datetime.strptime(payloads.run, runformat)
+
+        if args.profiles:
+            main_profiles(args.profiles, replay)
+        else:
+            try:
+                main(replay=replay)
+            except:
+                if replay is not None:
+                    raise
+                mail_self("notifier failed", traceback.format_exc())
+
+
 if __name__ == '__main__':
-    try:
-        main()
-    except:
-        import traceback
-        mail_self("notifier failed", traceback.format_exc())
+    cli()
@@ -3,7 +3,8 @@ import csv
 import hashlib
 import traceback
 from .event import Event, EventSource
-from .util import indent
+from .util import indent, sharedsource
+from .record import payload
 from subprocess import Popen, TimeoutExpired, PIPE
 
 
@@ -56,6 +57,20 @@ def parse(csvlines):
     return balance, transactions
 
 
+def run_dkbfetcher(invocation, pin):
+    """
+    runs dkbfetcher, passing pin via stdin
+
+    returns a tuple of (returncode, stdout, stderr)
+    """
+    proc = Popen(invocation, stdout=PIPE, stderr=PIPE, stdin=PIPE)
+
+    stdout, stderr = proc.communicate(input=pin.encode(), timeout=30)
+
+    return proc.returncode, stdout, stderr
+
+
+@sharedsource
 def query_dkb_visa(username, cc, pin):
     """
     yields transaction and balance events for a DKB VISA card
@@ -77,18 +92,18 @@ def query_dkb_visa(username, cc, pin):
                   '--output', '-',
                   '--raw']
 
-    proc = Popen(invocation, stdout=PIPE, stderr=PIPE, stdin=PIPE)
-
     yield EventSource("DKB VISA " + cc)
 
-    stdout, stderr = proc.communicate(input=pin.encode(), timeout=30)
+    returncode, stdout, stderr = payload(
+        ('dkb', username, cc),
+        lambda: run_dkbfetcher(invocation, pin))
 
     stdout = stdout.decode('iso-8859-1', errors='replace')
     stderr = stderr.decode('utf-8', errors='replace')
 
-    if proc.returncode != 0:
+    if returncode != 0:
         raise Exception("could not fetch CSV; return code: {}\n{}".format(
-            proc.returncode, indent(stderr)))
+            returncode, indent(stderr)))
 
     if not stdout.strip():
         raise Exception("could nto fetch CSV\n" + indent(stderr))
@@ -1,18 +1,34 @@
 from .event import Event, EventSource
-from .util import shorten
+from .util import shorten, sharedsource
+from .fetch import fetch
+from .record import payload
 import feedparser
 import traceback
 
 
-def query_feed(name, url, formatstring='{shortlink} {title}', limit=None):
-    yield EventSource(name)
+@sharedsource
+def parse_feed(url):
+    """
+    fetches and parses the feed at url, and yields its entries
+    """
+    response = payload(('feed', url), lambda: fetch(url))
+
+    if response.status != 200:
+        raise Exception('status != 200: {}'.format(response.status))
+
+    # the body is handed to feedparser as bytes; the headers are needed for
+    # charset detection and resolving relative links
+    headers = dict(response.headers)
+    headers.setdefault('content-location', response.url)
+    feed = feedparser.parse(response.body, response_headers=headers)
 
-    feed = feedparser.parse(url)
+    yield from feed['entries']
 
-    if feed['status'] != 200:
-        raise Exception('status != 200')
 
-    entries = feed['entries']
+def query_feed(name, url, formatstring='{shortlink} {title}', limit=None):
+    yield EventSource(name)
+
+    entries = list(parse_feed(url))
     if limit:
         entries = entries[:limit]
 
@@ -0,0 +1,287 @@
+import gzip
+import http.client
+import threading
+import time
+import urllib.parse
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class FetchError(Exception):
+    """
+    raised when a URL could not be fetched, even after retrying
+    """
+    pass
+
+
+class Response:
+    def __init__(self, url, status, headers, body):
+        """
+        url:
+            final URL, after following redirects
+        status:
+            HTTP status code
+        headers:
+            dict of response headers, with lower-case names
+        body:
+            the (decompressed) response body, as bytes
+        """
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+
+class Fetcher:
+    """
+    fetches URLs via HTTP(S), for use by all event sources.
+
+    connections are kept alive and re-used for further requests to the same
+    host, so fetching many URLs from one host costs only one TCP/TLS
+    handshake.
+
+    at most per_host requests to the same host, and at most max_connections
+    requests in total, are running at any time; further requests block until
+    a slot frees up. if max_bytes_per_second is given, all requests together
+    are throttled to that bandwidth.
+
+    failed requests (connection errors, timeouts, 429 and 5xx responses) are
+    retried up to retries times, waiting backoff * 2 ** n seconds before the
+    n-th retry.
+
+    thread-safe.
+    """
+
+    _retry_statuses = {429, 500, 502, 503, 504}
+    _redirect_statuses = {301, 302, 303, 307, 308}
+    _chunksize = 65536
+
+    def __init__(self, timeout=30, per_host=2, max_connections=8,
+                 max_bytes_per_second=None, retries=3, backoff=1,
+                 max_redirects=5, user_agent='eventdigest'):
+        self.timeout = timeout
+        self.per_host = per_host
+        self.max_bytes_per_second = max_bytes_per_second
+        self.retries = retries
+        self.backoff = backoff
+        self.max_redirects = max_redirects
+        self.user_agent = user_agent
+
+        encodings = ['gzip', 'deflate']
+        if brotli is not None:
+            encodings.append('br')
+        self._accept_encoding = ', '.join(encodings)
+
+        self._lock = threading.Lock()
+        # (scheme, netloc) -> list of idle connections
+        self._idle = {}
+        # (scheme, netloc) -> semaphore limiting parallel requests
+        self._hostslots = {}
+        self._slots = threading.BoundedSemaphore(max_connections)
+
+        self._bandwidth_lock = threading.Lock()
+        # point in time until which the bandwidth budget is used up
+        self._bandwidth_until = 0.0
+
+    def fetch(self, url, headers=None):
+        """
+        GETs url, following redirects, and returns a Response.
+
+        raises FetchError if the server could not be reached.
+        HTTP error statuses are not raised, but returned as Response.
+        """
+        for _ in range(self.max_redirects + 1):
+            response = self._fetch_retrying(url, headers)
+            location = response.headers.get('location')
+            if response.status not in self._redirect_statuses or not location:
+                return self._decoded(response)
+
+            url = urllib.parse.urljoin(url, location)
+
+        raise FetchError("too many redirects: " + url)
+
+    def close(self):
+        """
+        closes all idle connections
+        """
+        with self._lock:
+            idle, self._idle = self._idle, {}
+
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+    def _fetch_retrying(self, url, headers):
+        response, error = None, None
+
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+
+            try:
+                response, error = self._fetch_once(url, headers), None
+            except (OSError, http.client.HTTPException) as exc:
+                response, error = None, exc
+                continue
+
+            if response.status not in self._retry_statuses:
+                break
+
+        if response is None:
+            raise FetchError("could not fetch {}: {!r}".format(
+                url, error)) from error
+
+        return response
+
+    def _fetch_once(self, url, headers):
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in {'http', 'https'}:
+            raise ValueError("unsupported URL scheme: " + url)
+
+        host = (parts.scheme, parts.netloc)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        requestheaders = {
+            'Accept-Encoding': self._accept_encoding,
+            'User-Agent': self.user_agent,
+        }
+        requestheaders.update(headers or {})
+
+        with self._hostslot(host), self._slots:
+            conn, reused = self._acquire(host)
+            try:
+                try:
+                    resp = self._request(conn, path, requestheaders)
+                except ConnectionError:
+                    if not reused:
+                        raise
+                    # the server has closed the idle keep-alive connection
+                    conn.close()
+                    conn = self._connect(host)
+                    resp = self._request(conn, path, requestheaders)
+
+                body = self._read(resp)
+            except:
+                conn.close()
+                raise
+
+            if resp.will_close:
+                conn.close()
+            else:
+                self._release(host, conn)
+
+        respheaders = {k.lower(): v for k, v in resp.getheaders()}
+
+        return Response(url, resp.status, respheaders, body)
+
+    def _request(self, conn, path, headers):
+        conn.request('GET', path, headers=headers)
+        return conn.getresponse()
+
+    def _read(self, resp):
+        chunks = []
+        while True:
+            chunk = resp.read(self._chunksize)
+            if not chunk:
+                break
+            self._throttle(len(chunk))
+            chunks.append(chunk)
+
+        return b''.join(chunks)
+
+    def _decoded(self, response):
+        """
+        decompresses the body of response in-place, and returns response.
+
+        this happens outside of _fetch_retrying, since corrupt data is not
+        fixed by fetching it again.
+        """
+        encoding = response.headers.pop('content-encoding', '')
+        try:
+            response.body = self._decode(response.body, encoding)
+        except FetchError:
+            raise
+        except Exception as exc:
+            raise FetchError("could not decode {} body of {}: {!r}".format(
+                encoding, response.url, exc)) from exc
+
+        response.headers.pop('content-length', None)
+        return response
+
+    def _decode(self, body, encoding):
+        encoding = encoding.strip().lower()
+        if encoding in {'', 'identity'}:
+            return body
+        if encoding in {'gzip', 'x-gzip'}:
+            return gzip.decompress(body)
+        if encoding == 'deflate':
+            try:
+                return zlib.decompress(body)
+            except zlib.error:
+                # some servers send raw deflate streams without zlib header
+                return zlib.decompress(body, -zlib.MAX_WBITS)
+        if encoding == 'br' and brotli is not None:
+            return brotli.decompress(body)
+
+        raise FetchError("unsupported content encoding: " + encoding)
+
+    def _throttle(self, nbytes):
+        if not self.max_bytes_per_second:
+            return
+
+        with self._bandwidth_lock:
+            now = time.monotonic()
+            self._bandwidth_until = (max(now, self._bandwidth_until) +
+                                     nbytes / self.max_bytes_per_second)
+            delay = self._bandwidth_until - now
+
+        time.sleep(delay)
+
+    def _hostslot(self, host):
+        with self._lock:
+            if host not in self._hostslots:
+                self._hostslots[host] = threading.BoundedSemaphore(
+                    self.per_host)
+            return self._hostslots[host]
+
+    def _acquire(self, host):
+        """
+        returns a tuple of (connection, whether it is re-used)
+        """
+        with self._lock:
+            idle = self._idle.get(host)
+            if idle:
+                return idle.pop(), True
+
+        return self._connect(host), False
+
+    def _release(self, host, conn):
+        with self._lock:
+            idle = self._idle.setdefault(host, [])
+            if len(idle) < self.per_host:
+                idle.append(conn)
+                return
+
+        conn.close()
+
+    def _connect(self, host):
+        scheme, netloc = host
+        if scheme == 'https':
+            return http.client.HTTPSConnection(netloc, timeout=self.timeout)
+        return http.client.HTTPConnection(netloc, timeout=self.timeout)
+
+
+fetcher = Fetcher()
+
+
+def fetch(url, headers=None):
+    """
+    fetches url using the shared fetcher; see Fetcher.fetch
+    """
+    return fetcher.fetch(url, headers)
@@ -2,39 +2,31 @@ from datetime import datetime, timedelta
 import os
 import tempfile
 import sys
-from .util import run_task, multiprocessed, indent
+from .util import run_task, multiprocessed, sharedsource, indent
 from .event import Event, EventSource
+from .record import payload
 from collections import defaultdict
 
 
-# we need to run query_bank in a different process due to a limitation in
+# we need to run fetch_bank in a different process due to a limitation in
 # python-aqbanking. python-aqbanking segfaults when creating two different
 # BankingRequestor objects, as is needed for querying two different banks.
 # by running a fork befor each independent use of aqbanking functionality,
 # we avoid this.
 @multiprocessed
-def query_bank(bank_code, account_numbers, uname, pin):
+def fetch_bank(bank_code, account_numbers, uname, pin, now):
     """
-    yields transaction and balance events for accounts that are configured
-    in aqbanking (e.g. using GnuCash)
+    yields a single tuple of (transactions, balances), as returned by
+    aqbanking for the given accounts.
 
-    in case of an error or timeout, an error event containing the program
-    output and exception traceback is yielded.
+    account_numbers must be a list of str.
     """
     import aqbanking
 
-    now = datetime.now()
-
-    yield EventSource("HBCI %s" % bank_code)
-
     pin_name = "PIN_%d_%s" % (bank_code, uname)
     pin_value = pin
     config_dir = os.path.expanduser('~/.aqbanking')
     bank_code = str(bank_code)
-    if not isinstance(account_numbers, tuple):
-        account_numbers = (account_numbers,)
-
-    account_numbers = list(map(str, account_numbers))
 
     rq = aqbanking.BankingRequestor(
         pin_name=pin_name,
@@ -58,12 +50,38 @@ def query_bank(bank_code, account_numbers, uname, pin):
 
     balances, balances_output = run_task(rq.request_balances, [], 10, True)
 
-    events = defaultdict(lambda: [])
-
     if not balances:
         raise Exception("could not fetch balances:\n\n" +
                         indent(balances_output))
 
+    yield transactions, balances
+
+
+@sharedsource
+def query_bank(bank_code, account_numbers, uname, pin):
+    """
+    yields transaction and balance events for accounts that are configured
+    in aqbanking (e.g. using GnuCash)
+
+    in case of an error or timeout, an error event containing the program
+    output and exception traceback is yielded.
+    """
+    now = datetime.now()
+
+    yield EventSource("HBCI %s" % bank_code)
+
+    if not isinstance(account_numbers, tuple):
+        account_numbers = (account_numbers,)
+
+    account_numbers = list(map(str, account_numbers))
+
+    transactions, balances = payload(
+        ('hbci', bank_code, tuple(account_numbers), uname),
+        lambda: list(fetch_bank(bank_code, account_numbers, uname, pin,
+                                now))[0])
+
+    events = defaultdict(lambda: [])
+
     for transaction in transactions:
         uid = transaction['ui']
         currency = transaction['value_currency']
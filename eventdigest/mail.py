@@ -3,8 +3,9 @@ import smtplib
 import email.mime.text
 
 
-def mail_self(subject, text):
-        user = os.environ['USER']
+def mail_self(subject, text, user=None):
+        if user is None:
+            user = os.environ['USER']
         host = 'localhost'
         addr = user + '@' + host
         msg = email.mime.text.MIMEText(text)
@@ -0,0 +1,120 @@
+import hashlib
+import json
+import os
+import pickle
+import zlib
+
+
+class PayloadCache:
+    """
+    for use with a 'with' statement
+
+    >>> with PayloadCache(cfgpath + '/payloads', 'record'):
+    >>>     main()
+
+    content-addressed store for the raw payloads that event sources fetch
+    (feed bodies, dkbfetcher output, aqbanking transactions and balances),
+    which allows re-running the whole pipeline offline.
+
+    while active in 'record' mode, all payloads that are requested via
+    payload() are fetched as usual, and stored to the cache.
+    the run's index is written on exit.
+
+    while active in 'replay' mode, all payloads are loaded from the cache,
+    from the index of the given run (default: the latest run); nothing is
+    fetched.
+
+    layout:
+
+    objects/<sha256>:
+        zlib-compressed pickle of a payload
+    runs/<run>:
+        JSON dict that maps payload keys to object hashes
+    """
+    active = None
+
+    def __init__(self, path, mode, run=None):
+        if mode not in {'record', 'replay'}:
+            raise ValueError("invalid mode: " + repr(mode))
+
+        self.path = path
+        self.mode = mode
+        self.run = run
+        self.index = {}
+        self._objects = {}
+
+    def __enter__(self):
+        os.makedirs(self.path + '/objects', exist_ok=True)
+        os.makedirs(self.path + '/runs', exist_ok=True)
+
+        if self.mode == 'replay':
+            if self.run is None:
+                runs = sorted(os.listdir(self.path + '/runs'))
+                if not runs:
+                    raise FileNotFoundError(
+                        "no recorded runs in " + self.path)
+                self.run = runs[-1]
+
+            with open(self.path + '/runs/' + self.run) as f:
+                self.index = json.load(f)
+
+        self.outer, PayloadCache.active = PayloadCache.active, self
+
+    def __exit__(self, type, value, traceback):
+        PayloadCache.active = self.outer
+
+        if self.mode == 'record' and self.run is not None:
+            with open(self.path + '/runs/' + self.run, 'w') as f:
+                json.dump(self.index, f, indent=1, sort_keys=True)
+
+    def get(self, key, fetch):
+        """
+        returns the payload for key; see payload()
+        """
+        key = repr(key)
+
+        if self.mode == 'replay':
+            try:
+                digest = self.index[key]
+            except KeyError:
+                raise KeyError("no recorded payload for " + key) from None
+
+            return self._load(digest)
+
+        value = fetch()
+        self.index[key] = self._store(value)
+        return value
+
+    def _store(self, value):
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        digest = hashlib.sha256(data).hexdigest()
+
+        filename = self.path + '/objects/' + digest
+        if not os.path.exists(filename):
+            with open(filename + '.tmp', 'wb') as f:
+                f.write(zlib.compress(data, 9))
+            os.replace(filename + '.tmp', filename)
+
+        return digest
+
+    def _load(self, digest):
+        if digest not in self._objects:
+            with open(self.path + '/objects/' + digest, 'rb') as f:
+                self._objects[digest] = zlib.decompress(f.read())
+
+        return pickle.loads(self._objects[digest])
+
+
+def payload(key, fetch):
+    """
+    returns fetch(), the raw payload of an event source.
+
+    key is a tuple that identifies the payload (it must not contain
+    secrets). while a PayloadCache is active, the payload is recorded
+    under that key, or replayed without calling fetch.
+    """
+    cache = PayloadCache.active
+    if cache is None:
+        return fetch()
+
+    return cache.get(key, fetch)
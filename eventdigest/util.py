@@ -1,11 +1,16 @@
 import sys
 import traceback
-import collections
+import collections.abc
+import hashlib
+import contextlib
+import itertools
 import re
 import tempfile
 import os
 import signal
 import sqlite3
+import threading
+import time
 import uuid
 
 
@@ -52,7 +57,8 @@ def run_task(f, default, timeout=30, capture_output=True, *args, **kwargs):
 
 class SubProcessException(Exception):
     """
-    raised whenever a @multiprocessed function raises an exception
+    raised whenever a @multiprocessed function raises an exception,
+    or when a @sharedsource function re-raises a cached exception.
     contains the original exception's traceback as its second arg.
     """
     def __init__(self, arg):
@@ -114,6 +120,67 @@ def multiprocessed(function):
     return inner
 
 
+class SourceCache:
+    """
+    for use with a 'with' statement
+
+    >>> with SourceCache():
+    >>>     list(f(1)); list(f(1))
+
+    while active, each call to a @sharedsource function is evaluated only
+    once per distinct argument list; further identical calls replay the
+    results of the first call.
+    """
+    active = None
+
+    def __enter__(self):
+        self.results = {}
+        self.outer, SourceCache.active = SourceCache.active, self
+
+    def __exit__(self, type, value, traceback):
+        SourceCache.active = self.outer
+
+
+def sharedsource(function):
+    """
+    decorator for generator functions that query an event source.
+
+    while a SourceCache is active, identical calls (e.g. the same feed URL
+    in the cfg of several profiles) are evaluated only once; all yielded
+    objects are stored and yielded again by further calls.
+    if the original call raised an exception, further calls re-raise it as
+    SubProcessException, after yielding the same objects.
+
+    outside of a SourceCache, calls are passed through unmodified.
+    """
+
+    def inner(*args, **kwargs):
+        cache = SourceCache.active
+        if cache is None:
+            yield from function(*args, **kwargs)
+            return
+
+        key = (function, repr(args), repr(sorted(kwargs.items())))
+        if key not in cache.results:
+            results, exception = [], None
+            try:
+                for e in function(*args, **kwargs):
+                    results.append(e)
+            except Exception:
+                exception = traceback.format_exc()
+
+            cache.results[key] = results, exception
+
+        results, exception = cache.results[key]
+
+        yield from results
+
+        if exception:
+            raise SubProcessException(exception)
+
+    return inner
+
+
 class DummyContextManager:
     """
     for use with a 'with' statement
@@ -191,9 +258,43 @@ class Timeout:
         signal.alarm(0)
 
 
+def batched(iterable, n):
+    """
+    yields lists of up to n consecutive elements of iterable
+    """
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, n))
+        if not batch:
+            return
+        yield batch
+
+
 class AbstractSQLContainer:
+    """
+    base class for containers that are stored in an sqlite table.
+
+    connections to the database are taken from a small pool for each
+    operation, so containers can be shared between threads, and threads
+    that live for only one request (e.g. in the link shortener) re-use
+    existing connections. up to self.poolsize idle connections are kept.
+    the database is put in WAL mode, so readers and a writer (e.g. the
+    digest cronjob and the link shortener) don't block each other.
+
+    write transactions wait up to self.timeout seconds for the database
+    lock; if it is still locked, they are retried up to self.retries times,
+    waiting self.backoff * 2 ** n seconds before the n-th retry.
+    """
     _allowed_coltypes = {"UNIQUE", }
 
+    # number of rows that are fetched or written per batch
+    batchsize = 1000
+
+    timeout = 10
+    retries = 5
+    backoff = 0.1
+    poolsize = 4
+
     def __init__(self, database_filename, table, *cols):
         # sanitize inputs that will be passed as SQL commands
         self._sanitize_string(table, "table name")
@@ -207,11 +308,96 @@ class AbstractSQLContainer:
         self._database_filename = database_filename
         self._table_name = table
 
-        self._conn = sqlite3.connect(database_filename)
-        self._execute(
-            self._conn,
-            'CREATE TABLE IF NOT EXISTS {tablename} ({cols})',
-            cols=", ".join(cols))
+        self._pool = []
+        self._poollock = threading.Lock()
+
+        # WAL mode is persistent in the database file; setting it (and
+        # creating the table) takes the write lock, so check first
+        if self._selectone('PRAGMA journal_mode')[0].lower() != 'wal':
+            with self._connection() as conn:
+                self._retrying(conn.execute, 'PRAGMA journal_mode=WAL')
+
+        exists = self._selectone(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+            table)
+        if exists is None:
+            with self._transaction() as cur:
+                self._execute(
+                    cur,
+                    'CREATE TABLE IF NOT EXISTS {tablename} ({cols})',
+                    cols=", ".join(cols))
+
+    @contextlib.contextmanager
+    def _connection(self):
+        """
+        for use with a 'with' statement
+
+        >>> with self._connection() as conn:
+        >>>     conn.execute('SELECT 1')
+
+        takes a connection from the pool (or opens a new one), for exclusive
+        use by the calling thread, and returns it to the pool afterwards.
+        """
+        with self._poollock:
+            conn = self._pool.pop() if self._pool else None
+
+        if conn is None:
+            conn = sqlite3.connect(self._database_filename,
+                                   timeout=self.timeout,
+                                   check_same_thread=False)
+
+        try:
+            yield conn
+        finally:
+            with self._poollock:
+                if len(self._pool) < self.poolsize:
+                    self._pool.append(conn)
+                    conn = None
+
+            if conn is not None:
+                conn.close()
+
+    def close(self):
+        """
+        closes all idle connections to the database
+        """
+        with self._poollock:
+            pool, self._pool = self._pool, []
+
+        for conn in pool:
+            conn.close()
+
+    def _retrying(self, function, *args):
+        """
+        returns function(*args), retrying while the database is locked
+        """
+        attempt = 0
+        while True:
+            try:
+                return function(*args)
+            except sqlite3.OperationalError as exc:
+                locked = 'locked' in str(exc) or 'busy' in str(exc)
+                if not locked or attempt >= self.retries:
+                    raise
+
+            time.sleep(self.backoff * 2 ** attempt)
+            attempt += 1
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """
+        for use with a 'with' statement
+
+        >>> with self._transaction() as cur:
+        >>>     self._execute(cur, 'DELETE FROM {tablename}')
+
+        acquires the database's write lock up front (retrying while it is
+        locked), then commits on success or rolls back on error.
+        """
+        with self._connection() as conn:
+            self._retrying(conn.execute, 'BEGIN IMMEDIATE')
+            with conn:
+                yield conn.cursor()
 
     def _sanitize_string(self, string, what):
         if not re.match('^[a-z]+$', string):
@@ -222,13 +408,81 @@ class AbstractSQLContainer:
         formatargs['tablename'] = self._table_name
         obj.execute(statement.format(**formatargs), vals)
 
+    def _executemany(self, statement, rows, **formatargs):
+        """
+        executes statement for all rows, in batches of self.batchsize,
+        inside a single transaction.
+        """
+        formatargs['tablename'] = self._table_name
+        statement = statement.format(**formatargs)
+
+        # don't take the write lock if there is nothing to write
+        batches = batched(rows, self.batchsize)
+        first = next(batches, None)
+        if first is None:
+            return
+
+        with self._transaction() as cur:
+            for batch in itertools.chain([first], batches):
+                cur.executemany(statement, batch)
+
+    def _select(self, statement, *vals):
+        """
+        yields batches of rows of the query result, as lists of tuples.
+        rows are fetched from the cursor lazily.
+        """
+        with self._connection() as conn:
+            cur = conn.cursor()
+            try:
+                self._execute(cur, statement, *vals)
+                while True:
+                    rows = cur.fetchmany(self.batchsize)
+                    if not rows:
+                        return
+                    yield rows
+            finally:
+                cur.close()
+
+    def _selectone(self, statement, *vals):
+        """
+        returns the first row of the query result, or None
+        """
+        with self._connection() as conn:
+            cur = conn.cursor()
+            try:
+                self._execute(cur, statement, *vals)
+                return cur.fetchone()
+            finally:
+                cur.close()
+
+    def _selectcolumn(self, statement, *vals):
+        for rows in self._select(statement, *vals):
+            for row in rows:
+                yield row[0]
+
     def __len__(self):
-        cur = self._conn.cursor()
-        self._execute(cur, 'SELECT count(*) FROM {tablename}')
-        return cur.fetchone()[0]
+        return self._selectone('SELECT count(*) FROM {tablename}')[0]
+
+    def clear(self):
+        with self._transaction() as cur:
+            self._execute(cur, 'DELETE FROM {tablename}')
+
+
+class PersistentDictItemsView(collections.abc.ItemsView):
+    def __iter__(self):
+        for rows in self._mapping.export():
+            yield from rows
+
+
+class PersistentDictValuesView(collections.abc.ValuesView):
+    def __iter__(self):
+        return self._mapping._selectcolumn('SELECT val FROM {tablename}')
+
 
+class PersistentDict(AbstractSQLContainer, collections.abc.MutableMapping):
+    _upsert = ('INSERT INTO {tablename} (key, val) VALUES (?, ?) '
+               'ON CONFLICT(key) DO UPDATE SET val = excluded.val')
 
-class PersistentDict(AbstractSQLContainer, collections.MutableMapping):
     def __init__(self, database_filename=cfgpath + '/sqlite',
                  table='persistentdict', mapping={}):
 
@@ -238,90 +492,125 @@ class PersistentDict(AbstractSQLContainer, collections.MutableMapping):
         self.update(mapping)
 
     def __getitem__(self, key):
-        cur = self._conn.cursor()
-        self._execute(cur, 'SELECT val FROM {tablename} WHERE key = ?', key)
-
-        val = cur.fetchone()
+        val = self._selectone('SELECT val FROM {tablename} WHERE key = ?',
+                              key)
 
         if val is None:
             raise KeyError(key)
 
         return val[0]
 
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        row = self._selectone('SELECT 1 FROM {tablename} WHERE key = ?', key)
+
+        return row is not None
+
     def __setitem__(self, key, val):
-        cur = self._conn.cursor()
-        with self._conn:
-            if key in self:
-                self._execute(
-                    cur,
-                    'UPDATE {tablename} SET val = ? WHERE key = ?',
-                    val, key)
-            else:
-                self._execute(
-                    cur,
-                    'INSERT INTO {tablename} (key, val) VALUES (?, ?)',
-                    key, val)
+        with self._transaction() as cur:
+            self._execute(cur, self._upsert, key, val)
 
     def __delitem__(self, key):
-        cur = self._conn.cursor()
-        with self._conn:
+        with self._transaction() as cur:
             self._execute(cur, 'DELETE FROM {tablename} WHERE key = ?', key)
             if not cur.rowcount:
                 raise KeyError(key)
 
     def __iter__(self):
-        cur = self._conn.cursor()
-        self._execute(cur, 'SELECT key FROM {tablename}')
-        return iter([row[0] for row in cur])
+        return self._selectcolumn('SELECT key FROM {tablename}')
+
+    def items(self):
+        return PersistentDictItemsView(self)
+
+    def values(self):
+        return PersistentDictValuesView(self)
+
+    def update(self, other=(), **kwargs):
+        """
+        like dict.update, but all items are written in batches, inside a
+        single transaction.
+
+        other may be a mapping or an iterable of (key, val) pairs, such as
+        the rows from another PersistentDict's export().
+        """
+        if isinstance(other, collections.abc.Mapping):
+            other = other.items()
+        elif hasattr(other, 'keys'):
+            other = ((key, other[key]) for key in other.keys())
+
+        rows = itertools.chain(other, kwargs.items())
+        self._executemany(self._upsert, rows)
+
+    def export(self):
+        """
+        yields all (key, val) pairs, in batches (lists) of self.batchsize.
+
+        >>> for rows in d.export():
+        >>>     other.update(rows)
+        """
+        return self._select('SELECT key, val FROM {tablename}')
 
     def __str__(self):
-        return str(dict(self))
+        return str(dict(self.items()))
 
     def __repr__(self):
         return "PersistentDict({}, {}, {})".format(
             repr(self._database_filename),
             repr(self._table_name),
-            repr(dict(self)))
+            repr(dict(self.items())))
+
 
+class PersistentSet(AbstractSQLContainer, collections.abc.MutableSet):
+    _insert = 'INSERT OR IGNORE INTO {tablename} (elem) VALUES (?)'
 
-class PersistentSet(AbstractSQLContainer, collections.MutableSet):
     def __init__(self, database_filename=cfgpath + '/sqlite',
                  table='persistentset', collection=set()):
 
         AbstractSQLContainer.__init__(self, database_filename, table,
                                       "elem UNIQUE")
 
-        for x in collection:
-            self.add(x)
+        self.update(collection)
 
     def __contains__(self, elem):
-        cur = self._conn.cursor()
-        self._execute(cur, 'SELECT elem FROM {tablename} WHERE elem = ?', elem)
+        row = self._selectone('SELECT 1 FROM {tablename} WHERE elem = ?',
+                              elem)
 
-        return bool(cur.fetchall())
+        return row is not None
 
     def __iter__(self):
-        cur = self._conn.cursor()
-        self._execute(cur, 'SELECT elem FROM {tablename}')
-        return iter([row[0] for row in cur])
-
-    def __len__(self):
-        cur = self._conn.cursor()
-        self._execute(cur, 'SELECT count(*) FROM {tablename}')
-        return cur.fetchone()[0]
+        return self._selectcolumn('SELECT elem FROM {tablename}')
 
     def add(self, elem):
-        cur = self._conn.cursor()
-        with self._conn:
-            if elem not in self:
-                self._execute(cur, 'INSERT INTO {tablename} (elem) VALUES (?)',
-                              elem)
+        with self._transaction() as cur:
+            self._execute(cur, self._insert, elem)
 
     def discard(self, elem):
-        cur = self._conn.cursor()
-        with self._conn:
+        with self._transaction() as cur:
             self._execute(cur, 'DELETE FROM {tablename} WHERE elem = ?', elem)
 
+    def update(self, collection):
+        """
+        adds all elements of collection, in batches, inside a single
+        transaction.
+        """
+        rows = ((elem,) for elem in collection)
+        self._executemany(self._insert, rows)
+
+    def export(self):
+        """
+        yields all elements, in batches (lists) of self.batchsize.
+
+        >>> for elems in s.export():
+        >>>     other.update(elems)
+        """
+        for rows in self._select('SELECT elem FROM {tablename}'):
+            yield [row[0] for row in rows]
+
     def __str__(self):
         return str(set(self))
 
@@ -331,13 +620,43 @@ class PersistentSet(AbstractSQLContainer, collections.MutableSet):
             repr(self._table_name),
             repr(set(self)))
 
-redirects = PersistentDict(table="shortener")
-reverseredirects = PersistentDict(table="reverseshortener")
+
+# the link shortener tables of the current profile; opened on first use,
+# so importing this module doesn't require ~/.eventdigest to exist
+redirects = None
+reverseredirects = None
+shortenerreadonly = False
+
+
+def use_profile(path, readonly=False):
+    """
+    switches cfgpath and the link shortener tables to the profile
+    at the given path (default: ~/.eventdigest).
+
+    if readonly is True, shorten() doesn't store new links.
+    """
+    global cfgpath, redirects, reverseredirects, shortenerreadonly
+
+    shortenerreadonly = readonly
+
+    if path != cfgpath or redirects is None:
+        cfgpath = path
+        redirects = PersistentDict(path + '/sqlite', table="shortener")
+        reverseredirects = PersistentDict(path + '/sqlite',
+                                          table="reverseshortener")
 
 
 def shorten(url, length=8):
-    if url in reverseredirects:
-        return reverseredirects[url]
+    if redirects is None:
+        use_profile(cfgpath, shortenerreadonly)
+
+    short = reverseredirects.get(url)
+    if short is not None:
+        return short
+
+    if shortenerreadonly:
+        # a stable placeholder, which is never stored
+        return hashlib.sha1(url.encode()).hexdigest()[:length]
 
     errors = 0
     while True:
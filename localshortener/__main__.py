@@ -1,5 +1,7 @@
 import flask
-from eventdigest.util import redirects
+from eventdigest.util import PersistentDict
+
+redirects = PersistentDict(table="shortener")
 
 site = flask.Flask("shortener")
 
@@ -13,4 +15,4 @@ def redirecter(link):
 
 
 if __name__ == '__main__':
-    site.run(port=8080)
+    site.run(port=8080, threaded=True)